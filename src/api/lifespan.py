@@ -4,6 +4,8 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from src.modules.bookings.exchange_repository import exchange_booking_repository
+from src.modules.bookings.my_uni_repository import my_uni_booking_repository
 from src.modules.innohassle_accounts import innohassle_accounts
 
 
@@ -12,3 +14,6 @@ async def lifespan(_app: FastAPI):
     # Application startup
     await innohassle_accounts.update_key_set()
     yield
+    # Application shutdown
+    exchange_booking_repository.executor.shutdown(wait=False, cancel_futures=True)
+    await my_uni_booking_repository.close()
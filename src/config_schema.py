@@ -63,6 +63,8 @@ class Exchange(SettingBaseModel):
     "Username for accessing the EWS endpoint (email)"
     password: SecretStr
     "Password for accessing the EWS endpoint"
+    max_connections: int = 4
+    "Maximum number of parallel requests to the EWS endpoint"
 
 
 class Settings(SettingBaseModel):
@@ -75,8 +77,8 @@ class Settings(SettingBaseModel):
     'Prefix for the API path (e.g. "/api/v0")'
     rooms: list[Room] = []
     "List of rooms"
-    ics_cache_ttl_seconds: int = 60
-    "TTL for the ICS cache in seconds"
+    busy_info_cache_ttl_seconds: int = 60
+    "TTL for the cache of bookings fetched from Exchange free/busy info, in seconds"
     cors_allow_origin_regex: str = ".*"
     "Allowed origins for CORS: from which domains requests to the API are allowed. Specify as a regex: `https://.*.innohassle.ru`"
     accounts: Accounts
@@ -1,9 +1,15 @@
+import asyncio
 import datetime
+import functools
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import exchangelib
-import pytz
 from exchangelib.errors import ErrorMailRecipientNotFound
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from zoneinfo import ZoneInfo
 
 import src.modules.bookings.patch_exchangelib  # noqa
 from src.config import settings
@@ -11,6 +17,9 @@ from src.modules.rooms.repository import room_repository
 
 
 class Booking(BaseModel):
+    # Instances are shared between the cache and all responses, so they must not be changed
+    model_config = ConfigDict(frozen=True)
+
     room_id: str
     "ID of the room"
     title: str
@@ -25,14 +34,36 @@ class ExchangeBookingRepository:
     ews_endpoint: str
     account_email: str
     account: exchangelib.Account
-
-    def __init__(self, ews_endpoint: str, account_email: str):
+    executor: ThreadPoolExecutor
+    "Threads for blocking EWS requests, separate from the default executor"
+    CACHE_MAX_ENTRIES = 2048
+    FREE_BUSY_MAX_MAILBOXES = 100
+    "EWS GetUserAvailability accepts at most 100 mailboxes per request"
+    _cache_bookings_from_busy_info: OrderedDict[
+        tuple[str, datetime.datetime, datetime.datetime], tuple[list[Booking], float]
+    ]
+    "(room_id, start, end) -> (bookings, monotonic time of expiration), in least recently used order"
+    _inflight_busy_info: dict[tuple[tuple[str, ...], datetime.datetime, datetime.datetime], asyncio.Task]
+    "(room_ids, start, end) -> task fetching the bookings, shared by concurrent callers"
+    _room_generations: dict[str, int]
+    "room_id -> number of times its cache was expired, so that fetches started before that are not cached"
+
+    def __init__(self, ews_endpoint: str, account_email: str, max_connections: int):
         self.ews_endpoint = ews_endpoint
         self.account_email = account_email
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="ews")
+        self._cache_bookings_from_busy_info = OrderedDict()
+        self._inflight_busy_info = {}
+        self._room_generations = {}
 
         config = exchangelib.Configuration(
             auth_type=exchangelib.transport.NOAUTH,
             service_endpoint=self.ews_endpoint,
+            # Allow as many sessions as there are EWS threads, so that parallel requests don't wait for each other
+            max_connections=max_connections,
+            # Back off when EWS is throttling or unavailable instead of failing immediately; the back off is shared
+            # between all threads, so a struggling server is not hammered by every request
+            retry_policy=exchangelib.FaultTolerance(max_wait=10),
         )
         self.account = exchangelib.Account(
             self.account_email,
@@ -42,47 +73,168 @@ class ExchangeBookingRepository:
         )
 
     def fetch_bookings(self, room_ids: list[str], start: datetime.datetime, end: datetime.datetime) -> list[Booking]:
-        rooms = room_repository.get_by_ids(room_ids)
-        room_emails = [room.resource_email for room in rooms]
-
-        accounts = [(email, "Resource", False) for email in room_emails]
-        bookings: list[Booking] = []
-        for i, busy_info in enumerate(
-            self.account.protocol.get_free_busy_info(
-                accounts=accounts,
-                start=exchangelib.EWSDateTime.from_datetime(start),
-                end=exchangelib.EWSDateTime.from_datetime(end),
-                merged_free_busy_interval=5,
+        # Unknown rooms are skipped, so that the remaining rooms still match their busy infos in order
+        rooms = [room for room in room_repository.get_by_ids(room_ids) if room is not None]
+        accounts = [(room.resource_email, "Resource", False) for room in rooms]
+        busy_infos = self.account.protocol.get_free_busy_info(
+            accounts=accounts,
+            start=exchangelib.EWSDateTime.from_datetime(start),
+            end=exchangelib.EWSDateTime.from_datetime(end),
+            merged_free_busy_interval=5,
+        )
+        # Fields come from the EWS response with known types, so skip validation
+        return [
+            Booking.model_construct(
+                room_id=room.id,
+                title=(calendar_event.details.subject or "Busy") if calendar_event.details else "Busy",
+                start=calendar_event.start,
+                end=calendar_event.end,
             )
-        ):
-            if isinstance(busy_info, ErrorMailRecipientNotFound) or busy_info.calendar_events is None:
-                continue
-            for calendar_event in busy_info.calendar_events:
-                bookings.append(
-                    Booking(
-                        room_id=rooms[i].id,
-                        title=(calendar_event.details.subject or "Busy") if calendar_event.details else "Busy",
-                        start=calendar_event.start,
-                        end=calendar_event.end,
-                    )
-                )
+            for room, busy_info in zip(rooms, busy_infos)
+            if not isinstance(busy_info, ErrorMailRecipientNotFound) and busy_info.calendar_events is not None
+            for calendar_event in busy_info.calendar_events
+        ]
+
+    def _get_cached_bookings(
+        self, room_id: str, start: datetime.datetime, end: datetime.datetime
+    ) -> list[Booking] | None:
+        key = (room_id, start, end)
+        cached = self._cache_bookings_from_busy_info.get(key)
+        if cached is None:
+            return None
+        bookings, expires_at = cached
+        if time.monotonic() >= expires_at:
+            return None
+        self._cache_bookings_from_busy_info.move_to_end(key)
         return bookings
 
-    def get_bookings_for_all_rooms(self, from_dt: datetime.datetime, to_dt: datetime.datetime):
+    def _set_cached_bookings(
+        self, room_id: str, start: datetime.datetime, end: datetime.datetime, bookings: list[Booking], ttl: float
+    ) -> None:
+        key = (room_id, start, end)
+        expires_at = time.monotonic() + ttl
+        self._cache_bookings_from_busy_info[key] = (bookings, expires_at)
+        self._cache_bookings_from_busy_info.move_to_end(key)
+        while len(self._cache_bookings_from_busy_info) > self.CACHE_MAX_ENTRIES:
+            self._cache_bookings_from_busy_info.popitem(last=False)
+
+    def _prune_cache(self) -> None:
+        now = time.monotonic()
+        for key, (_, expires_at) in list(self._cache_bookings_from_busy_info.items()):
+            if now >= expires_at:
+                del self._cache_bookings_from_busy_info[key]
+
+    def expire_cache_for_room(self, room_id: str, start: datetime.datetime, end: datetime.datetime) -> None:
+        """
+        Drop cached bookings of the room that overlap with the given interval, e.g. after the booking was created.
+        """
+        start = to_msk(start)
+        end = to_msk(end)
+        for key in list(self._cache_bookings_from_busy_info):
+            cached_room_id, cached_start, cached_end = key
+            if cached_room_id == room_id and cached_start < end and cached_end > start:
+                del self._cache_bookings_from_busy_info[key]
+        # Fetches in flight may have read the room before the change: new callers must not join them,
+        # and they must not put their result into the cache
+        for key in list(self._inflight_busy_info):
+            inflight_room_ids, inflight_start, inflight_end = key
+            if room_id in inflight_room_ids and inflight_start < end and inflight_end > start:
+                del self._inflight_busy_info[key]
+        self._room_generations[room_id] = self._room_generations.get(room_id, 0) + 1
+
+    async def _run_ews(self, fn, *args, **kwargs):
+        # EWS requests (and conversion of their responses) are blocking, so run them in the EWS threads
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def _fetch_and_cache_bookings(
+        self, room_ids: tuple[str, ...], start: datetime.datetime, end: datetime.datetime
+    ) -> dict[str, list[Booking]]:
+        generations = {room_id: self._room_generations.get(room_id, 0) for room_id in room_ids}
+        fetched: dict[str, list[Booking]] = {room_id: [] for room_id in room_ids}
+        # Split rooms into requests that EWS accepts, and send them in parallel
+        n = self.FREE_BUSY_MAX_MAILBOXES
+        chunks = [list(room_ids[i : i + n]) for i in range(0, len(room_ids), n)]
+        for bookings in await asyncio.gather(
+            *(self._run_ews(self.fetch_bookings, chunk, start, end) for chunk in chunks)
+        ):
+            for booking in bookings:
+                fetched[booking.room_id].append(booking)
+
+        self._prune_cache()
+        # Jitter the TTL once per fetch: rooms fetched together expire together,
+        # but entries of different fetches do not all expire at the same moment
+        ttl = settings.busy_info_cache_ttl_seconds * random.uniform(0.85, 1.15)
+        for room_id, bookings in fetched.items():
+            if self._room_generations.get(room_id, 0) == generations[room_id]:
+                self._set_cached_bookings(room_id, start, end, bookings, ttl)
+        return fetched
+
+    def _forget_inflight(self, key: tuple[tuple[str, ...], datetime.datetime, datetime.datetime], task: asyncio.Task):
+        # The key may already belong to a newer task if this one was dropped by expire_cache_for_room
+        if self._inflight_busy_info.get(key) is task:
+            del self._inflight_busy_info[key]
+
+    async def get_bookings(
+        self, room_ids: list[str], start: datetime.datetime, end: datetime.datetime
+    ) -> list[Booking]:
+        # Fetch and cache whole minutes, so that requests a few seconds apart share the cache
+        range_start = floor_to_minute(start)
+        range_end = ceil_to_minute(end)
+
+        room_id_x_bookings: dict[str, list[Booking]] = {}
+        missing_room_ids: list[str] = []
+        for room_id in room_ids:
+            cached = self._get_cached_bookings(room_id, range_start, range_end)
+            if cached is None:
+                missing_room_ids.append(room_id)
+            else:
+                room_id_x_bookings[room_id] = cached
+
+        if missing_room_ids:
+            key = (tuple(missing_room_ids), range_start, range_end)
+            task = self._inflight_busy_info.get(key)
+            if task is None:
+                task = asyncio.create_task(self._fetch_and_cache_bookings(*key))
+                self._inflight_busy_info[key] = task
+                task.add_done_callback(functools.partial(self._forget_inflight, key))
+            # Shield the shared task, so that a cancelled caller does not cancel it for the others
+            room_id_x_bookings.update(await asyncio.shield(task))
+
+        # Cut off bookings that are only in the rounded range
+        return [
+            booking
+            for room_id in room_ids
+            for booking in room_id_x_bookings[room_id]
+            if booking.start < end and booking.end > start
+        ]
+
+    async def get_bookings_for_all_rooms(self, from_dt: datetime.datetime, to_dt: datetime.datetime) -> list[Booking]:
         from_dt = to_msk(from_dt)
         to_dt = to_msk(to_dt)
         room_ids = [room.id for room in room_repository.get_all()]
-        return self.fetch_bookings(room_ids, from_dt, to_dt)
+        return await self.get_bookings(room_ids, from_dt, to_dt)
 
 
-_timezone = pytz.timezone("Europe/Moscow")
+# Not a fixed UTC+3 offset: EWS needs a named timezone to map it to the Windows "Russian Standard Time"
+_timezone = ZoneInfo("Europe/Moscow")
 
 
 def to_msk(dt: datetime.datetime) -> datetime.datetime:
     return dt.astimezone(_timezone)
 
 
+def floor_to_minute(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(second=0, microsecond=0)
+
+
+def ceil_to_minute(dt: datetime.datetime) -> datetime.datetime:
+    floored = floor_to_minute(dt)
+    return floored if floored == dt else floored + datetime.timedelta(minutes=1)
+
+
 exchange_booking_repository = ExchangeBookingRepository(
     ews_endpoint=settings.exchange.ews_endpoint,
     account_email=settings.exchange.username,
+    max_connections=settings.exchange.max_connections,
 )
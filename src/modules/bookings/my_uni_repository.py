@@ -1,9 +1,10 @@
+import asyncio
 import datetime
 from json import JSONDecodeError
 
 import httpx
 from httpx import HTTPStatusError, Response
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from src.api.logging_ import logger
 from src.config import settings
@@ -23,16 +24,34 @@ class MyUniBooking(BaseModel):
     "End time of booking"
 
 
+_my_uni_bookings_adapter = TypeAdapter(list[MyUniBooking])
+
+
 class MyUniBookingRepository:
     api_url: str
     api_token: str
+    client: httpx.AsyncClient
+    "Authorized client, shared by all requests to reuse connections"
+    CONNECT_RETRIES = 3
 
     def __init__(self, api_url: str, api_token: str):
         self.api_url = api_url
         self.api_token = api_token
+        self.client = httpx.AsyncClient(headers={"X-Booking-Token": f"{self.api_token}"}, base_url=self.api_url)
+
+    async def close(self):
+        await self.client.aclose()
 
-    def get_authorized_client(self) -> httpx.AsyncClient:
-        return httpx.AsyncClient(headers={"X-Booking-Token": f"{self.api_token}"}, base_url=self.api_url)
+    async def request(self, method: str, url: str, **kwargs) -> Response:
+        # Retry only failed connection attempts: the request was not sent yet, so it is safe even for POST.
+        # Status codes are not retried, as My University may have already applied a booking that answered 5xx
+        for attempt in range(self.CONNECT_RETRIES + 1):
+            try:
+                return await self.client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == self.CONNECT_RETRIES:
+                    raise
+                await asyncio.sleep(0.5 * 2**attempt)
 
     def extract_error(self, response: Response) -> str | None:
         try:
@@ -47,79 +66,84 @@ class MyUniBookingRepository:
             return error_msg
 
     async def list_user_bookings(self, email: str) -> tuple[list[MyUniBooking] | None, str | None]:
-        async with self.get_authorized_client() as client:
-            response = await client.get(
-                "/room-booking/list",
-                params={
-                    "email": email,
-                },
-            )
-            error = self.extract_error(response)
-            if error is not None:
-                return None, error
-
-            data = response.json()
-
-            if not data["bookings"]:
-                # No bookings (data["bookings"] is empty list)
-                return [], None
-
-            # Validate the response (data["bookings"] is a dict)
-            bookings = data["bookings"].values()
-            return [
-                MyUniBooking.model_validate(
-                    {
-                        **booking,
-                        "room_id": room_repository.get_by_my_uni_id(booking["room_id"]).id,
-                        # start_time is "2024-10-17 03:00:00" in MSK time
-                        "start": datetime.datetime.strptime(booking["start_time"], "%Y-%m-%d %H:%M:%S").replace(
-                            tzinfo=datetime.timezone(datetime.timedelta(hours=3))
-                        ),
-                        "end": datetime.datetime.strptime(booking["end_time"], "%Y-%m-%d %H:%M:%S").replace(
-                            tzinfo=datetime.timezone(datetime.timedelta(hours=3))
-                        ),
-                    }
-                )
+        response = await self.request(
+            "GET",
+            "/room-booking/list",
+            params={
+                "email": email,
+            },
+        )
+        error = self.extract_error(response)
+        if error is not None:
+            return None, error
+
+        data = response.json()
+
+        if not data["bookings"]:
+            # No bookings (data["bookings"] is empty list)
+            return [], None
+
+        # Validate the response (data["bookings"] is a dict)
+        bookings = data["bookings"].values()
+        return _my_uni_bookings_adapter.validate_python(
+            [
+                {
+                    **booking,
+                    "room_id": room_repository.get_by_my_uni_id(booking["room_id"]).id,
+                    # start_time is "2024-10-17 03:00:00" in MSK time
+                    "start": parse_msk(booking["start_time"]),
+                    "end": parse_msk(booking["end_time"]),
+                }
                 for booking in bookings
-            ], None
+            ]
+        ), None
 
     async def create_booking(
         self, email: str, my_uni_room_id: int, title: str, start: datetime.datetime, end: datetime.datetime
     ) -> tuple[bool, str | None]:
-        async with self.get_authorized_client() as client:
-            response = await client.post(
-                "/room-booking/create",
-                params={
-                    "email": email,
-                    "room": my_uni_room_id,
-                    "title": title,
-                    "start": start.astimezone(datetime.timezone(datetime.timedelta(hours=3))).isoformat(
-                        timespec="minutes"
-                    )[0:16],  # "2024-10-17T03:00", msk time
-                    "end": end.astimezone(datetime.timezone(datetime.timedelta(hours=3))).isoformat(timespec="minutes")[
-                        0:16
-                    ],  # "2024-10-17T04:00", msk time
-                },
-            )
-            error = self.extract_error(response)
-            if error is not None:
-                return False, error
-
-            return True, None
+        response = await self.request(
+            "POST",
+            "/room-booking/create",
+            params={
+                "email": email,
+                "room": my_uni_room_id,
+                "title": title,
+                "start": format_msk(start),
+                "end": format_msk(end),
+            },
+        )
+        error = self.extract_error(response)
+        if error is not None:
+            return False, error
+
+        return True, None
 
     async def delete_booking(self, booking_id: int) -> tuple[bool, str | None]:
-        async with self.get_authorized_client() as client:
-            response = await client.delete(
-                "/room-booking/delete",
-                params={
-                    "id": booking_id,
-                },
-            )
-            error = self.extract_error(response)
-            if error is not None:
-                return False, error
-
-            return True, None
+        response = await self.request(
+            "DELETE",
+            "/room-booking/delete",
+            params={
+                "id": booking_id,
+            },
+        )
+        error = self.extract_error(response)
+        if error is not None:
+            return False, error
+
+        return True, None
+
+
+_timezone = datetime.timezone(datetime.timedelta(hours=3))  # MSK
+
+
+def parse_msk(s: str) -> datetime.datetime:
+    # fromisoformat is much faster than strptime, and accepts "2024-10-17 03:00:00"
+    return datetime.datetime.fromisoformat(s).replace(tzinfo=_timezone)
+
+
+def format_msk(dt: datetime.datetime) -> str:
+    # "2024-10-17T03:00", msk time
+    return dt.astimezone(_timezone).isoformat(timespec="minutes")[0:16]
 
 
 my_uni_booking_repository = MyUniBookingRepository(
@@ -1,6 +1,8 @@
 import exchangelib
 import pycurl
 import requests
+from exchangelib.properties import FreeBusyViewOptions, MailboxData, TimeWindow, TimeZone
+from exchangelib.services import GetUserAvailability
 from requests_curl import CURLAdapter
 from requests_curl.request import CURLRequest
 
@@ -46,3 +48,39 @@ def raw_session(cls, prefix, oauth2_client=None, oauth2_session_params=None, oau
 
 
 exchangelib.protocol.BaseProtocol.raw_session = raw_session
+
+
+# (MS timezone id, year) -> timezone for GetUserAvailability
+_free_busy_timezones: dict[tuple[str, int], TimeZone] = {}
+
+
+def get_free_busy_info(self, accounts, start, end, merged_free_busy_interval=30, requested_view="DetailedMerged"):
+    # Same as the original, but the timezone definition is requested from the server only once,
+    # instead of an extra GetServerTimeZones round-trip before every GetUserAvailability request
+    key = (start.tzinfo.ms_id, start.year)
+    timezone = _free_busy_timezones.get(key)
+    if timezone is None:
+        tz_definition = list(self.get_timezones(timezones=[start.tzinfo], return_full_timezone_data=True))[0]
+        timezone = TimeZone.from_server_timezone(tz_definition=tz_definition, for_year=start.year)
+        _free_busy_timezones[key] = timezone
+
+    return GetUserAvailability(self).call(
+        tzinfo=start.tzinfo,
+        mailbox_data=[
+            MailboxData(
+                email=account.primary_smtp_address if isinstance(account, exchangelib.Account) else account,
+                attendee_type=attendee_type,
+                exclude_conflicts=exclude_conflicts,
+            )
+            for account, attendee_type, exclude_conflicts in accounts
+        ],
+        timezone=timezone,
+        free_busy_view_options=FreeBusyViewOptions(
+            time_window=TimeWindow(start=start, end=end),
+            merged_free_busy_interval=merged_free_busy_interval,
+            requested_view=requested_view,
+        ),
+    )
+
+
+exchangelib.protocol.Protocol.get_free_busy_info = get_free_busy_info
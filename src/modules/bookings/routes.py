@@ -27,7 +27,7 @@ async def bookings(
     end: datetime.datetime = Query(example=(_now + timedelta(hours=9)).isoformat(timespec="minutes")),
 ) -> list[Booking]:
     # Fetch the bookings from Outlook
-    return exchange_booking_repository.get_bookings_for_all_rooms(start, end)
+    return await exchange_booking_repository.get_bookings_for_all_rooms(start, end)
 
 
 @router.get("/bookings/my")
@@ -63,6 +63,9 @@ async def create_booking(
     if not success:
         raise HTTPException(409, error_message)
 
+    # Outlook will show the new booking, so don't serve the cached free/busy info for this time
+    exchange_booking_repository.expire_cache_for_room(room.id, start, end)
+
     # Success
     return True
 
@@ -73,7 +76,8 @@ async def delete_booking(user: VerifiedDep, booking_id: int) -> bool:
     bookings, error_message = await my_uni_booking_repository.list_user_bookings(user.email)
     if bookings is None:
         raise ValueError(error_message)
-    if booking_id not in [booking.id for booking in bookings]:
+    booking = next((booking for booking in bookings if booking.id == booking_id), None)
+    if booking is None:
         raise ObjectNotFound()
 
     # Delete the booking from My University
@@ -81,5 +85,8 @@ async def delete_booking(user: VerifiedDep, booking_id: int) -> bool:
     if not success:
         raise HTTPException(404, error_message)
 
+    # The room is free now, so don't serve the cached free/busy info for this time
+    exchange_booking_repository.expire_cache_for_room(booking.room_id, booking.start, booking.end)
+
     # Success
     return True